@@ -1,20 +1,26 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
+import numpy as np
+import ahocorasick
 import time
 import os
 import urllib3
 import random
-import warnings
+import re
 import logging
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
-from urllib.parse import urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import heapq
+from urllib.parse import urlsplit
+from xxhash import xxh3_64_intdigest
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import deque
+from itertools import cycle
+from threading import Lock, Event, Timer
 from tqdm import tqdm
-from threading import Lock
 
 # Security & Terminal Cleanup
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
 # --- NEW: Tqdm-Compatible Logging ---
 class TqdmLoggingHandler(logging.Handler):
@@ -26,12 +32,55 @@ class TqdmLoggingHandler(logging.Handler):
         except Exception:
             self.handleError(record)
 
+# File handler that flushes at most every `interval` seconds instead of after every record.
+# A timer gets buffered records to disk within `interval` even if logging goes quiet.
+# Warnings and errors are written straight away; closing writes out whatever is left.
+class ThrottledFileHandler(logging.FileHandler):
+    def __init__(self, filename, interval=2.0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.interval = interval
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._closed = False
+
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno >= logging.WARNING:
+            self._flush_now()
+
+    def flush(self):
+        if time.monotonic() - self._last_flush > self.interval:
+            self._flush_now()
+        elif self._timer is None and not self._closed:
+            self._timer = Timer(self.interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_now(self):
+        super().flush()
+        self._last_flush = time.monotonic()
+
+    def _timed_flush(self):
+        with self.lock:
+            self._timer = None
+            self._flush_now()
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.stream is not None:
+                self._flush_now()
+        super().close()
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 log_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', '%H:%M:%S')
 
 # File logging
-file_handler = logging.FileHandler("reconflow.log")
+file_handler = ThrottledFileHandler("reconflow.log")
 file_handler.setFormatter(log_formatter)
 logger.addHandler(file_handler)
 
@@ -40,17 +89,37 @@ console_handler = TqdmLoggingHandler()
 console_handler.setFormatter(log_formatter)
 logger.addHandler(console_handler)
 
+def _netloc(url):
+    return urlsplit(url).netloc
+
+def _url_sig(url):
+    # 64-bit digest of host+path: far smaller than keeping the strings around.
+    # Plain string ops yield the same netloc/path as urlsplit for absolute URLs, without a SplitResult.
+    rest = url.split('://', 1)[-1].split('#', 1)[0].split('?', 1)[0]
+    netloc, sep, path = rest.partition('/')
+    return xxh3_64_intdigest(f"{netloc}\0{sep}{path}".encode())
+
 class ReconFlow:
+    # Login forms sit near the top of the document, no need to parse the whole page
+    _PW_RE = re.compile(rb'<input[^>]+type\s*=\s*["\']?password', re.IGNORECASE)
+    _BODY_PEEK = 65536
+
     def __init__(self, proxy_list=None):
         self.cc_index = "CC-MAIN-2026-04" 
         self.api_url = f"http://index.commoncrawl.org/{self.cc_index}-index"
         
         self.keywords = ['login', 'signin', 'auth', 'admin', 'portal', 'dashboard', 'account', 'register']
-        self.blacklist = ('.jpg', '.png', '.css', '.js', '.pdf', '.svg', '.zip', '.docx', '.gif')
+        self.blacklist = ('.jpg', '.jpeg', '.png', '.css', '.js', '.pdf', '.svg', '.zip', '.docx', '.gif')
         self.noise_words = ['/news/', '/blog/', '/help/', '/faq/', '/terms/', '/privacy/']
+        self._kw_ac = self._build_automaton(self.keywords)
+        # Extensions also match when followed by a query string or fragment (e.g. logo.png?v=2)
+        exts = '|'.join(re.escape(ext.lstrip('.')) for ext in self.blacklist)
+        self._bl_re = re.compile(rf'\.(?:{exts})(?:$|[?#])', re.IGNORECASE).search
+        self._noise_re = re.compile('|'.join(map(re.escape, self.noise_words))).search
         
         self.state_file = "recon_state.json"
         self.query_progress = self._load_progress_dict()
+        self.state_save_pages = 10
         self.proxy_pool = proxy_list if proxy_list else []
         self.ua_list = [
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
@@ -58,12 +127,41 @@ class ReconFlow:
             "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0"
         ]
         
-        self.domain_locks = {}
-        self.lock_manager = Lock()
+        self.headers = {"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"}
+        self.session = self._build_session()
+        self.proxy_sessions = {px: self._build_session(px) for px in self.proxy_pool}
+        # Round-robin keeps load even and lets each proxy session keep its connections warm
+        self._proxy_cycle = cycle(self.proxy_pool)
+        self._proxy_lock = Lock()
+
+        self.buckets: dict[str, tuple[float, float]] = {}
         self.delay_per_domain = 1.2 
+        self.page_retries = 3
+        self.page_backoff = 10
+        self.cc_page_workers = 5
         self.total_portals_found = 0
         logger.info(f"ReconFlow initialized. Mode: Proxy-First. Index: {self.cc_index}")
 
+    @staticmethod
+    def _build_automaton(words):
+        # One pass over the URL regardless of how many words we look for
+        automaton = ahocorasick.Automaton()
+        for w in words:
+            automaton.add_word(w, w)
+        automaton.make_automaton()
+        return automaton
+
+    def _build_session(self, proxy=None):
+        # Pooled keep-alive connections so repeat hosts skip the TCP/TLS handshake
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=256, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        if proxy:
+            session.proxies = {"http": proxy, "https": proxy}
+        return session
+
     def _load_progress_dict(self):
         if os.path.exists(self.state_file):
             with open(self.state_file, 'r') as f:
@@ -71,6 +169,12 @@ class ReconFlow:
                 except: return {}
         return {}
 
+    def _save_progress(self):
+        # Write to a temp file and swap it in so a crash never leaves a torn state file
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, 'w') as sf: json.dump(self.query_progress, sf)
+        os.replace(tmp_path, self.state_file)
+
     def _get_folder(self, query):
         clean_name = query.replace("*", "").replace("/", "").replace(".", "_").strip("_")
         folder_name = f"recon_{clean_name}"
@@ -79,78 +183,230 @@ class ReconFlow:
         return folder_name
 
     def _check_url_life(self, target_url):
-        p = urlparse(target_url)
-        self._smart_delay(p.netloc)
         headers = {"User-Agent": random.choice(self.ua_list)}
         
         # --- PHASE 1: PROXY FIRST ---
         if self.proxy_pool:
-            px = random.choice(self.proxy_pool)
-            try:
-                r = requests.get(target_url, proxies={"http":px, "https":px}, headers=headers, timeout=10, verify=False, allow_redirects=True)
-                if r.status_code == 200:
-                    return self._analyze_content(r.text), True
-                logger.debug(f"Proxy {px} returned {r.status_code} for {target_url}")
-            except Exception as e:
-                logger.debug(f"Proxy Attempt Failed for {target_url} via {px}: {str(e)[:50]}")
+            with self._proxy_lock:
+                px = next(self._proxy_cycle)
+            status = self._probe(self.proxy_sessions[px], target_url, headers)
+            if self._is_dead_status(status):
+                return "DEAD", False
+            # A failed probe may just be the proxy, so the raw path still gets a try.
+            # A 401/403 won't turn into a 200 on GET, so leave the verdict to the raw probe.
+            if status is not None and status not in (401, 403):
+                try:
+                    r = self.proxy_sessions[px].get(target_url, headers=headers, timeout=10, verify=False, allow_redirects=True, stream=True)
+                    with r:
+                        if r.status_code == 200:
+                            return self._analyze_content(r), True
+                    logger.debug(f"Proxy {px} returned {r.status_code} for {target_url}")
+                except Exception as e:
+                    logger.debug(f"Proxy Attempt Failed for {target_url} via {px}: {str(e)[:50]}")
 
         # --- PHASE 2: RAW FALLBACK ---
+        status = self._probe(self.session, target_url, headers)
+        if status is None or self._is_dead_status(status):
+            return "DEAD", False
+        if status in (401, 403):
+            return "LOCKED/WAF", True
         try:
-            r = requests.get(target_url, headers=headers, timeout=7, verify=False, allow_redirects=True)
-            if r.status_code == 200:
-                return self._analyze_content(r.text), True
-            elif r.status_code in [403, 401]:
-                return "LOCKED/WAF", True
+            r = self.session.get(target_url, headers=headers, timeout=7, verify=False, allow_redirects=True, stream=True)
+            with r:
+                if r.status_code == 200:
+                    return self._analyze_content(r), True
+                elif r.status_code in [403, 401]:
+                    return "LOCKED/WAF", True
         except Exception as e:
             logger.debug(f"Raw connection failed for {target_url}: {str(e)[:50]}")
             
         return "DEAD", False
 
-    def _analyze_content(self, html):
-        soup = BeautifulSoup(html, 'html.parser')
+    def _probe(self, session, target_url, headers):
+        # HEAD is far cheaper than a full GET for weeding out dead targets. None means it never connected.
+        try:
+            with session.head(target_url, headers=headers, timeout=3, verify=False, allow_redirects=True) as h:
+                return h.status_code
+        except Exception as e:
+            logger.debug(f"HEAD probe failed for {target_url}: {str(e)[:50]}")
+            return None
+
+    @staticmethod
+    def _is_dead_status(status):
+        # 401/403 mean something is guarding the page; 405/429 say nothing about the page itself
+        return status is not None and 400 <= status < 500 and status not in (401, 403, 405, 429)
+
+    def _analyze_content(self, r):
+        # Only HTML can hold a login form, anything else is just a live asset
+        if not r.headers.get('Content-Type', 'text/html').lower().startswith('text/html'):
+            return "LIVE"
+        head = r.raw.read(self._BODY_PEEK, decode_content=True)
         # Check for password fields or common portal indicators
-        is_form = bool(soup.find('input', {'type': 'password'}))
+        is_form = bool(self._PW_RE.search(head))
         return "PORTAL" if is_form else "LIVE"
 
-    def _smart_delay(self, domain):
-        with self.lock_manager:
-            last = self.domain_locks.get(domain, 0)
-            wait = self.delay_per_domain - (time.time() - last)
-            if wait > 0: time.sleep(wait)
-            self.domain_locks[domain] = time.time()
+    def _take_token(self, domain, now):
+        # Per-domain token bucket holding one request, refilled at 1 / delay_per_domain per second
+        tokens, last = self.buckets.get(domain, (1.0, now))
+        tokens = min(1.0, tokens + (now - last) / self.delay_per_domain)
+        if tokens >= 1.0:
+            self.buckets[domain] = (tokens - 1.0, now)
+            return True
+        self.buckets[domain] = (tokens, now)
+        return False
+
+    def _next_token_at(self, domain):
+        tokens, last = self.buckets[domain]
+        return last + (1.0 - tokens) * self.delay_per_domain
+
+    def _iter_lines(self, resp):
+        # Yields complete newline-terminated records from a streamed response
+        buf = b""
+        for chunk in resp.iter_content(chunk_size=1 << 16):
+            buf += chunk
+            *lines, buf = buf.split(b'\n')
+            yield from lines
+        if buf: yield buf
+
+    def _fetch_cc_page(self, query, page, off=0, stop=None):
+        # Returns (urls, off, complete). urls is None once the index has no such page.
+        # Setting `stop` makes an abandoned fetch give up instead of retrying.
+        params = {'url': query, 'output': 'json', 'fl': 'url', 'page': page}
+        stop = stop or Event()
+        urls = []
+        retries = 0
+        while not stop.is_set():
+            # Resume a partially read page. Identity encoding keeps the byte offset meaningful.
+            headers = {'Range': f'bytes={off}-', 'Accept-Encoding': 'identity'} if off else None
+            try:
+                resp = self.session.get(self.api_url, params=params, headers=headers, timeout=25, stream=True)
+                with resp:
+                    if resp.status_code == 404: return None, off, True
+                    if resp.status_code not in (200, 206, 416):
+                        retries += 1
+                        if retries > self.page_retries:
+                            logger.error(f"CC API Error {resp.status_code}. Giving up on page {page} at byte {off}")
+                            return urls, off, False
+                        # Back off harder each time; `off` is kept so the retry resumes with Range
+                        backoff = self.page_backoff * 2 ** (retries - 1)
+                        logger.error(f"CC API Error {resp.status_code}. Sleeping {backoff}s...")
+                        stop.wait(backoff); continue
+
+                    # 416: nothing left past the offset. 200: server ignored Range, skip what we already have.
+                    pos = off if resp.status_code == 206 else 0
+                    lines = self._iter_lines(resp) if resp.status_code != 416 else ()
+                    for line in lines:
+                        pos += len(line) + 1
+                        if pos <= off: continue
+                        off = pos
+                        if not line: continue
+                        # Keyword check on the raw record so non-matching lines are never JSON-parsed
+                        line = line.decode('utf-8', 'replace').lower()
+                        if next(self._kw_ac.iter(line), None) is None: continue
+                        url = orjson.loads(line).get('url', '')
+                        if not self._bl_re(url):
+                            urls.append(url)
+                return urls, off, True
+            except requests.RequestException as e:
+                retries += 1
+                if retries <= self.page_retries:
+                    logger.warning(f"[{query}] Page {page} interrupted at byte {off}, resuming: {str(e)[:50]}")
+                    continue
+                logger.error(f"Discovery Error: {e}")
+                return urls, off, False
+        return urls, off, False
+
+    def _load_sigs(self, raw_path, sig_path, state):
+        # Digests are kept as packed little-endian uint64s next to the URL list,
+        # so a rerun loads them in one read instead of re-parsing every URL.
+        # The state entry records both file sizes at the last save; only when they no longer
+        # match (e.g. after a hard kill) are the URL lines counted, and rebuilt if that disagrees too.
+        if not os.path.exists(raw_path):
+            if os.path.exists(sig_path): os.remove(sig_path)
+            return set()
+        if os.path.exists(sig_path):
+            n_sigs = os.path.getsize(sig_path) // 8
+            if state.get("sigs") == n_sigs and state.get("raw_size") == os.path.getsize(raw_path):
+                return set(np.fromfile(sig_path, dtype='<u8').tolist())
+            with open(raw_path, "rb") as f:
+                n_urls = sum(1 for line in f if line.strip())
+            if os.path.getsize(sig_path) == n_urls * 8:
+                return set(np.fromfile(sig_path, dtype='<u8').tolist())
+        with open(raw_path, "r") as f:
+            sigs = [_url_sig(line.strip()) for line in f if line.strip()]
+        np.array(sigs, dtype='<u8').tofile(sig_path)
+        return set(sigs)
+
+    def _record_file_sizes(self, query, raw_path, sig_path):
+        # Lets the next run trust discovered_sigs.bin without rereading the URL file
+        self.query_progress[query].update(raw_size=os.path.getsize(raw_path), sigs=os.path.getsize(sig_path) // 8)
 
     def run_discovery(self, query, record_limit=500):
         folder = self._get_folder(query)
         raw_path = os.path.join(folder, "discovered_urls.txt")
-        seen_sigs = set()
-        
-        page = self.query_progress.get(query, 0)
+        sig_path = os.path.join(folder, "discovered_sigs.bin")
+        state = self.query_progress.get(query, 0)
+        if isinstance(state, int): state = {"page": state, "off": 0} # Pre-resume state files
+        self.query_progress[query] = state
+        page, off = state["page"], state["off"]
+        seen_sigs: set[int] = self._load_sigs(raw_path, sig_path, state)
         total_saved = 0
+        unsaved_pages = 0
+        done = False
+        stop = Event()
+        pool = ThreadPoolExecutor(max_workers=self.cc_page_workers)
 
-        with open(raw_path, "a") as f:
-            while total_saved < record_limit:
-                params = {'url': query, 'output': 'json', 'fl': 'url', 'page': page}
-                try:
-                    resp = requests.get(self.api_url, params=params, timeout=25)
-                    if resp.status_code == 404: break
-                    if resp.status_code != 200:
-                        logger.error(f"CC API Error {resp.status_code}. Sleeping...")
-                        time.sleep(10); continue
+        try:
+            with open(raw_path, "ab", buffering=1 << 20) as f, open(sig_path, "ab") as sig_f:
+                while total_saved < record_limit and not done:
+                    batch = {pool.submit(self._fetch_cc_page, query, p, off if p == page else 0, stop): p
+                             for p in range(page, page + self.cc_page_workers)}
+                    results = {}
+                    for fut in as_completed(batch):
+                        try:
+                            results[batch[fut]] = fut.result()
+                        except Exception as e:
+                            logger.error(f"Discovery Error: {e}")
+                            results[batch[fut]] = None
 
-                    lines = resp.text.splitlines()
-                    for line in lines:
-                        url = json.loads(line).get('url', '').lower()
-                        if any(k in url for k in self.keywords) and not url.endswith(self.blacklist):
-                            f.write(url + "\n")
-                            total_saved += 1
-                    
-                    logger.info(f"[{query}] Crawled Page {page} | Found {total_saved} unique URLs")
-                    page += 1
-                    self.query_progress[query] = page
-                    with open(self.state_file, 'w') as sf: json.dump(self.query_progress, sf)
-                except Exception as e:
-                    logger.error(f"Discovery Error: {e}")
-                    break
+                        # Only move past the contiguous run of finished pages so the saved state stays exact
+                        while not done and page in results:
+                            result = results.pop(page)
+                            if result is None or result[0] is None:
+                                done = True; break
+                            urls, off, complete = result
+                            for url in urls:
+                                sig = _url_sig(url)
+                                if sig not in seen_sigs:
+                                    seen_sigs.add(sig)
+                                    f.write(url.encode() + b"\n")
+                                    sig_f.write(sig.to_bytes(8, 'little'))
+                                    total_saved += 1
+                            if not complete:
+                                done = True; break
+
+                            logger.info(f"[{query}] Crawled Page {page} | Found {total_saved} unique URLs")
+                            page += 1
+                            off = 0
+                            unsaved_pages += 1
+                            if total_saved >= record_limit: done = True
+                        if done: break
+                    self.query_progress[query].update(page=page, off=off)
+                    if unsaved_pages >= self.state_save_pages:
+                        # State must never run ahead of the URLs and digests on disk
+                        f.flush()
+                        sig_f.flush()
+                        self._record_file_sizes(query, raw_path, sig_path)
+                        self._save_progress()
+                        unsaved_pages = 0
+                    if not done: time.sleep(1) # Stay polite with the CC index between batches
+        finally:
+            # Don't wait on sibling pages nobody needs any more
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            # The URL and digest files are closed (and flushed) by now, so the saved state can't run ahead of them
+            self._record_file_sizes(query, raw_path, sig_path)
+            self._save_progress()
 
     def run_validation(self, query, threads=20):
         folder = self._get_folder(query)
@@ -161,23 +417,60 @@ class ReconFlow:
         
         with open(raw_path, "r") as f:
             to_validate = list(set(line.strip() for line in f if line.strip()))
+        to_validate = [u for u in to_validate if not self._noise_re(u)]
 
         pbar = tqdm(total=len(to_validate), desc=f"Validating {query}", unit="url", ncols=100)
 
         with open(gold_path, "a") as gold_f:
             with ThreadPoolExecutor(max_workers=threads) as executor:
-                futures = {executor.submit(self._check_url_life, u): u for u in to_validate}
-                for fut in as_completed(futures):
-                    url = futures[fut]
-                    res, is_live = fut.result()
-                    if is_live:
-                        if res == "PORTAL":
-                            logger.info(f"FOUND PORTAL: {url}") # This now prints above the bar!
-                            gold_f.write(url + "\n")
-                            self.total_portals_found += 1
-                        else:
-                            logger.info(f"Live Asset: {url}")
-                    pbar.update(1)
+                # Only hand a URL over when a worker is free to start it right away, so the
+                # token taken here really marks the request start. Everything else waits on
+                # the scheduler side: `ready` in order, or `deferred` until its domain's
+                # bucket refills. Workers never sleep.
+                ready = deque(to_validate)
+                deferred = {}
+                wakeups = []
+                inflight = {}
+                cap = threads
+                while ready or deferred or inflight:
+                    now = time.monotonic()
+                    while wakeups and wakeups[0][0] <= now and len(inflight) < cap:
+                        _, domain = heapq.heappop(wakeups)
+                        waiting = deferred[domain]
+                        if self._take_token(domain, now):
+                            u = waiting.popleft()
+                            inflight[executor.submit(self._check_url_life, u)] = u
+                        if waiting: heapq.heappush(wakeups, (self._next_token_at(domain), domain))
+                        else: del deferred[domain]
+
+                    while ready and len(inflight) < cap:
+                        u = ready.popleft()
+                        domain = _netloc(u)
+                        if domain not in deferred and self._take_token(domain, now):
+                            inflight[executor.submit(self._check_url_life, u)] = u
+                            continue
+                        if domain not in deferred:
+                            deferred[domain] = deque()
+                            heapq.heappush(wakeups, (self._next_token_at(domain), domain))
+                        deferred[domain].append(u)
+
+                    if not inflight:
+                        time.sleep(max(0, wakeups[0][0] - time.monotonic()))
+                        continue
+
+                    timeout = max(0, wakeups[0][0] - time.monotonic()) if wakeups and len(inflight) < cap else None
+                    done, _ = wait(inflight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        url = inflight.pop(fut)
+                        res, is_live = fut.result()
+                        if is_live:
+                            if res == "PORTAL":
+                                logger.info(f"FOUND PORTAL: {url}") # This now prints above the bar!
+                                gold_f.write(url + "\n")
+                                self.total_portals_found += 1
+                            else:
+                                logger.info(f"Live Asset: {url}")
+                        pbar.update(1)
         pbar.close()
 
 if __name__ == "__main__":
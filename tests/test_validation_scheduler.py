@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+from collections import defaultdict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from ReconFlow import ReconFlow
+    return ReconFlow()
+
+
+def test_requests_to_same_domain_start_at_least_delay_apart(bot):
+    query = "*.example.com/*"
+    # Two slow one-off hosts tie up both workers while x.com URLs keep getting released
+    urls = ["http://slow-a.com/login", "http://slow-b.com/login"] + [f"http://x.com/login/{i}" for i in range(4)]
+    with open(os.path.join(bot._get_folder(query), "discovered_urls.txt"), "w") as f:
+        f.write("\n".join(urls) + "\n")
+
+    bot.delay_per_domain = 0.2
+    starts = defaultdict(list)
+
+    def fake_check(url):
+        starts[url.split("/")[2]].append(time.monotonic())
+        time.sleep(0.6 if "slow" in url else 0.01)
+        return "LIVE", True
+
+    bot._check_url_life = fake_check
+    bot.run_validation(query, threads=2)
+
+    assert sum(len(v) for v in starts.values()) == len(urls)
+    for domain, times in starts.items():
+        if len(times) < 2: continue
+        times.sort()
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # Small allowance for the hand-off between scheduler and worker thread
+        assert min(gaps) >= bot.delay_per_domain - 0.02, (domain, gaps)